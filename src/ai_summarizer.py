@@ -1,10 +1,117 @@
-import os
+import orjson
+import time
+import asyncio
 import logging
+import threading
+from typing import Iterator
+import httpx
 import google.genai as genai
+from google.genai import errors, types
+from tenacity import (
+    before_sleep_log,
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
 from config import Config
+from cache import SummaryCache
 
 logger = logging.getLogger(__name__)
 
+# Shared Gemini client so every summarizer call reuses the same connection pool
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_client() -> genai.Client:
+    """Returns the process-wide Gemini client, creating it on first use."""
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = genai.Client(
+                    api_key=Config.GEMINI_API_KEY,
+                    http_options=types.HttpOptions(
+                        async_client_args={
+                            'limits': httpx.Limits(
+                                max_connections=50,
+                                max_keepalive_connections=20,
+                                keepalive_expiry=30
+                            )
+                        }
+                    )
+                )
+    return _CLIENT
+
+
+class RateLimiter:
+    """Thread-safe token bucket shared by the sync and async Gemini paths."""
+
+    def __init__(self, rate: int, period: float):
+        self.capacity = rate
+        self.interval = period / rate
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Takes a token and returns how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) / self.interval)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens * self.interval)
+
+    def acquire(self):
+        """Blocks only the calling thread until a request slot is available."""
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """Suspends only the calling coroutine until a request slot is available."""
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+_LIMITER = RateLimiter(Config.GEMINI_REQUESTS_PER_MINUTE, 60)
+
+
+def _is_transient(error: BaseException) -> bool:
+    """Throttling, server-side and network errors are worth retrying; auth and bad requests are not."""
+    if isinstance(error, errors.ServerError):
+        return True
+    if isinstance(error, errors.ClientError):
+        return error.code == 429
+    return isinstance(error, httpx.TransportError)
+
+
+_retry_transient = retry(
+    stop=stop_after_attempt(Config.MAX_RETRIES),
+    wait=wait_exponential_jitter(initial=1, max=10),
+    retry=retry_if_exception(_is_transient),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
+    reraise=True,
+)
+
+
+BATCH_PROMPT = """You will receive {count} numbered emails.
+Return ONLY a JSON array of exactly {count} strings, where element i is the summary of email i.
+Summarize each email following these instructions:
+{instructions}
+"""
+
+BATCH_EMAIL_BLOCK = """
+--- Email {number} ---
+From: {sender}
+Subject: {subject}
+Body: {body}
+"""
+
+
 class EmailSummarizer:
     """Handles email summarization using the Gemini API."""
 
@@ -13,10 +120,11 @@ class EmailSummarizer:
         if not Config.GEMINI_API_KEY:
             logger.error("GEMINI_API_KEY not found in config.")
             raise ValueError("GEMINI_API_KEY not found in config.")
-        
-        self.client = genai.Client(api_key=Config.GEMINI_API_KEY)
+
+        self.client = get_client()
         self.model_name = f"models/{Config.GEMINI_MODEL}"
         self.model = None
+        self.cache = SummaryCache(Config.GEMINI_MODEL)
         logger.info(f"Initialized Gemini AI with model: {Config.GEMINI_MODEL}")
 
     def test_connection(self) -> bool:
@@ -33,31 +141,182 @@ class EmailSummarizer:
             logger.error(f"Gemini API connection failed: {e}", exc_info=True)
             return False
 
-    def summarize_email(self, email_data: dict) -> str | None:
+    def _build_prompt(self, email_data: dict) -> str:
+        """Fills the configured summary template with the email fields."""
+        return Config.SUMMARY_PROMPT.format(
+            sender=email_data.get('sender', 'N/A'),
+            subject=email_data.get('subject', 'N/A'),
+            body=email_data.get('body', '')
+        )
+
+    def _is_trivial(self, email_body: str) -> bool:
+        """Very short emails (confirmations, one-liners) are clearer as-is than summarized."""
+        return len(email_body) < Config.AI_SKIP_THRESHOLD and len(email_body.split()) < 30
+
+    def _fallback_summary(self, email_data: dict) -> str:
+        """Uses the email text itself as the summary."""
+        return email_data.get('body', '').strip() or email_data.get('snippet', '')
+
+    @_retry_transient
+    def _call_gemini(self, prompt: str, config: types.GenerateContentConfig | None = None):
+        """Sends one generate request, retrying transient failures within the rate limit."""
+        _LIMITER.acquire()
+        return self.client.models.generate_content(model=self.model_name, contents=prompt, config=config)
+
+    @_retry_transient
+    async def _call_gemini_async(self, prompt: str):
+        """Async variant of _call_gemini."""
+        await _LIMITER.acquire_async()
+        return await self.client.aio.models.generate_content(model=self.model_name, contents=prompt)
+
+    def _prepare(self, email_data: dict) -> tuple[str | None, str | None, str | None]:
         """
-        Summarizes an email using the Gemini API.
+        Runs the checks shared by every summarize path before Gemini is called.
+
+        Returns:
+            (summary, prompt, cache_key). prompt is None when no request is needed; summary is
+            then the result to use (None if the model is not initialized).
         """
         if not self.model:
             logger.error("Summarizer model not initialized. Run test_connection() first.")
-            return None
+            return None, None, None
 
         email_body = email_data.get('body', '')
         if not email_body:
             logger.warning("Email body is empty, cannot summarize.")
-            return "This email has no content to summarize."
+            return "This email has no content to summarize.", None, None
 
+        if self._is_trivial(email_body):
+            return self._fallback_summary(email_data), None, None
+
+        prompt = self._build_prompt(email_data)
+        cache_key = self.cache.make_key(prompt)
+        cached = self.cache.get(cache_key, email_data)
+        if cached is not None:
+            return cached, None, None
+        return None, prompt, cache_key
+
+    def summarize_email(self, email_data: dict) -> str | None:
+        """
+        Summarizes an email using the Gemini API.
+        """
         try:
-            prompt_template = Config.get_summary_prompt()
-            prompt = prompt_template.format(
-                sender=email_data.get('sender', 'N/A'),
-                subject=email_data.get('subject', 'N/A'),
-                body=email_body
-            )
-            
-            response = self.model.generate_content(prompt)
-            
+            summary, prompt, cache_key = self._prepare(email_data)
+        except Exception as e:
+            logger.error(f"An error occurred while generating the summary: {e}", exc_info=True)
+            return None
+        if prompt is None:
+            return summary
+        return self._generate(prompt, cache_key, email_data)
+
+    def _generate(self, prompt: str, cache_key: str, email_data: dict) -> str | None:
+        """Requests a summary for an already-prepared prompt and caches it."""
+        try:
+            response = self._call_gemini(prompt)
+
             summary = response.text.strip()
+            self.cache.set(cache_key, summary, email_data)
             return summary
         except Exception as e:
             logger.error(f"An error occurred while generating the summary: {e}", exc_info=True)
             return None
+
+    async def summarize_email_async(self, email_data: dict) -> str | None:
+        """
+        Summarizes an email using the async Gemini client.
+        """
+        try:
+            # Cache lookups hit SQLite, Redis or the sentence encoder, so keep them off the event loop
+            summary, prompt, cache_key = await asyncio.to_thread(self._prepare, email_data)
+            if prompt is None:
+                return summary
+
+            response = await self._call_gemini_async(prompt)
+
+            summary = response.text.strip()
+            await asyncio.to_thread(self.cache.set, cache_key, summary, email_data)
+            return summary
+        except Exception as e:
+            logger.error(f"An error occurred while generating the summary: {e}", exc_info=True)
+            return None
+
+    def summarize_email_stream(self, email_data: dict) -> Iterator[str]:
+        """
+        Summarizes an email, yielding text chunks as Gemini produces them.
+        Cached summaries are yielded as a single chunk.
+        """
+        try:
+            summary, prompt, cache_key = self._prepare(email_data)
+            if prompt is None:
+                if summary is not None:
+                    yield summary
+                return
+
+            _LIMITER.acquire()
+            chunks = []
+            for chunk in self.client.models.generate_content_stream(model=self.model_name, contents=prompt):
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    yield chunk.text
+
+            summary = ''.join(chunks).strip()
+            if summary:
+                self.cache.set(cache_key, summary, email_data)
+        except Exception as e:
+            logger.error(f"An error occurred while streaming the summary: {e}", exc_info=True)
+
+    def summarize_batch(self, emails: list[dict]) -> list[str | None]:
+        """
+        Summarizes several emails with a single Gemini request.
+        Falls back to per-email calls if the response cannot be parsed.
+        """
+        if not self.model:
+            logger.error("Summarizer model not initialized. Run test_connection() first.")
+            return [None] * len(emails)
+
+        summaries = [None] * len(emails)
+        pending = []
+        for i, email_data in enumerate(emails):
+            summary, prompt, cache_key = self._prepare(email_data)
+            if prompt is None:
+                summaries[i] = summary
+            else:
+                pending.append((i, prompt, cache_key))
+
+        if not pending:
+            return summaries
+        if len(pending) == 1:
+            i, prompt, cache_key = pending[0]
+            summaries[i] = self._generate(prompt, cache_key, emails[i])
+            return summaries
+
+        prompt = BATCH_PROMPT.format(count=len(pending), instructions=Config.get_summary_instructions())
+        prompt += ''.join(
+            BATCH_EMAIL_BLOCK.format(
+                number=number,
+                sender=emails[i].get('sender', 'N/A'),
+                subject=emails[i].get('subject', 'N/A'),
+                body=emails[i].get('body', '')
+            )
+            for number, (i, _, _) in enumerate(pending, start=1)
+        )
+
+        try:
+            response = self._call_gemini(
+                prompt,
+                config=types.GenerateContentConfig(response_mime_type='application/json')
+            )
+            results = orjson.loads(response.text)
+            if not isinstance(results, list) or len(results) != len(pending):
+                raise ValueError(f"expected {len(pending)} summaries, got {results!r:.200}")
+        except Exception as e:
+            logger.warning(f"Batch summary failed, summarizing individually: {e}")
+            for i, prompt, cache_key in pending:
+                summaries[i] = self._generate(prompt, cache_key, emails[i])
+            return summaries
+
+        for (i, _, cache_key), summary in zip(pending, results):
+            summary = str(summary).strip()
+            self.cache.set(cache_key, summary, emails[i])
+            summaries[i] = summary
+        return summaries
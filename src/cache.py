@@ -0,0 +1,290 @@
+"""
+Caching for the email pipeline.
+Persists generated summaries so repeated emails skip the Gemini round-trip,
+and tracks which Gmail messages have already been handled.
+"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Summaries kept in process memory in front of the persistent store
+MEMORY_CACHE_SIZE = 1024
+# Most entries kept in the semantic index; the oldest tenth is dropped when it is full
+SEMANTIC_CACHE_SIZE = 10000
+
+_REDIS = None
+_REDIS_LOCK = threading.Lock()
+
+
+def get_redis():
+    """Return the shared Redis client, or None when REDIS_URL is not configured"""
+    global _REDIS
+    if not Config.REDIS_URL:
+        return None
+    if _REDIS is None:
+        with _REDIS_LOCK:
+            if _REDIS is None:
+                import redis
+                _REDIS = redis.Redis.from_url(Config.REDIS_URL, decode_responses=True)
+                logger.info("Using Redis for shared caches")
+    return _REDIS
+
+
+class SummaryCache:
+    """
+    Summary cache: exact prompt match in memory and on disk (or Redis),
+    plus an optional semantic match for near-duplicate emails.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.ttl = Config.SUMMARY_CACHE_TTL
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+
+        # With Redis the exact tier is shared between workers; otherwise it lives in SQLite
+        self._redis = get_redis()
+        self._db = None
+        if self._redis is None:
+            Config.DATA_DIR.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(Config.DATA_DIR / 'llm_cache.sqlite', check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS summaries '
+                '(key TEXT PRIMARY KEY, summary TEXT NOT NULL, expires INTEGER NOT NULL)'
+            )
+            self._db.execute('DELETE FROM summaries WHERE expires <= ?', (int(time.time()),))
+            self._db.commit()
+
+        self._encoder = None
+        self._index = None
+        self._semantic_summaries = []
+        # Embeddings computed by a missed get(), handed to the matching set() so each email is encoded once
+        self._embeddings = OrderedDict()
+        if Config.SEMANTIC_CACHE_ENABLED:
+            self._init_semantic()
+
+    def _init_semantic(self):
+        """Load the sentence encoder and FAISS index used for near-duplicate lookups"""
+        try:
+            import faiss
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            logger.warning(f"Semantic cache disabled, missing dependency: {e}")
+            return
+
+        self._encoder = SentenceTransformer('all-MiniLM-L6-v2')
+        self._index = faiss.IndexFlatIP(self._encoder.get_sentence_embedding_dimension())
+        logger.info("Semantic summary cache enabled")
+
+    def make_key(self, prompt: str) -> str:
+        """Build the exact-match key; includes the model so a model change invalidates entries"""
+        bucket = len(prompt) // 1024
+        digest = hashlib.blake2b(prompt.encode('utf-8'), digest_size=16).hexdigest()
+        return f"{self.model_name}:{bucket}:{digest}"
+
+    def get(self, key: str, email_data: Optional[dict] = None) -> Optional[str]:
+        """
+        Look up a cached summary.
+
+        Args:
+            key: Exact-match key from make_key()
+            email_data: Email data used for the semantic fallback lookup
+
+        Returns:
+            Cached summary, or None on a miss
+        """
+        with self._lock:
+            summary = self._memory.get(key)
+            if summary is not None:
+                self._memory.move_to_end(key)
+                return summary
+
+        summary = self._get_exact(key)
+        if summary is not None:
+            logger.debug(f"Summary cache hit: {key}")
+            self._remember(key, summary)
+            return summary
+
+        if email_data is not None and self._index is not None:
+            embedding = self._embed(email_data)
+            with self._lock:
+                if self._index.ntotal:
+                    scores, ids = self._index.search(embedding, 1)
+                    if scores[0][0] >= Config.SEMANTIC_CACHE_THRESHOLD:
+                        logger.debug(f"Semantic cache hit (score {scores[0][0]:.3f})")
+                        return self._semantic_summaries[ids[0][0]]
+                self._embeddings[key] = embedding
+                if len(self._embeddings) > MEMORY_CACHE_SIZE:
+                    self._embeddings.popitem(last=False)
+
+        return None
+
+    def set(self, key: str, summary: str, email_data: Optional[dict] = None):
+        """Store a summary under the exact key and, if enabled, in the semantic index"""
+        self._remember(key, summary)
+        self._set_exact(key, summary)
+
+        if email_data is not None and self._index is not None:
+            with self._lock:
+                embedding = self._embeddings.pop(key, None)
+            if embedding is None:
+                embedding = self._embed(email_data)
+            with self._lock:
+                self._index.add(embedding)
+                self._semantic_summaries.append(summary)
+                if self._index.ntotal > SEMANTIC_CACHE_SIZE:
+                    self._evict_semantic()
+
+    def _evict_semantic(self):
+        """Drop the oldest semantic entries; flat indexes renumber on removal, keeping IDs aligned"""
+        import numpy as np
+        drop = self._index.ntotal - SEMANTIC_CACHE_SIZE * 9 // 10
+        self._index.remove_ids(np.arange(drop, dtype='int64'))
+        del self._semantic_summaries[:drop]
+
+    def _remember(self, key: str, summary: str):
+        with self._lock:
+            self._memory[key] = summary
+            self._memory.move_to_end(key)
+            if len(self._memory) > MEMORY_CACHE_SIZE:
+                self._memory.popitem(last=False)
+
+    def _get_exact(self, key: str) -> Optional[str]:
+        if self._redis is not None:
+            try:
+                return self._redis.get(f"sum:{key}")
+            except Exception as e:
+                logger.warning(f"Redis summary lookup failed: {e}")
+                return None
+
+        with self._lock:
+            row = self._db.execute(
+                'SELECT summary FROM summaries WHERE key = ? AND expires > ?',
+                (key, int(time.time()))
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set_exact(self, key: str, summary: str):
+        if self._redis is not None:
+            try:
+                self._redis.setex(f"sum:{key}", self.ttl, summary)
+            except Exception as e:
+                logger.warning(f"Redis summary store failed: {e}")
+            return
+
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO summaries (key, summary, expires) VALUES (?, ?, ?)',
+                (key, summary, int(time.time()) + self.ttl)
+            )
+            self._db.commit()
+
+    def _embed(self, email_data: dict):
+        """Normalized embedding of subject plus the start of the body"""
+        text = f"{email_data.get('subject', '')}\n{email_data.get('body', '')[:512]}"
+        return self._encoder.encode([text], normalize_embeddings=True).astype('float32')
+
+
+class ProcessedIds:
+    """
+    Bounded LRU set of Gmail message IDs that have already been claimed for processing.
+    With Redis configured the set is shared, so only one worker processes each message;
+    otherwise delivered IDs are also written to SQLite so they survive restarts.
+    """
+
+    def __init__(self, maxsize: int = None, path=None):
+        self.maxsize = maxsize or Config.PROCESSED_CACHE_SIZE
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = get_redis()
+
+        self._db = None
+        if self._redis is None and path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS ids (id TEXT PRIMARY KEY, ts INTEGER NOT NULL)')
+            self._db.commit()
+
+    def load(self) -> int:
+        """
+        Reload the most recently processed IDs from disk and prune older ones.
+
+        Returns:
+            Number of IDs loaded
+        """
+        if self._db is None:
+            return 0
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT id FROM ids ORDER BY ts DESC, rowid DESC LIMIT ?', (self.maxsize,)
+            ).fetchall()
+            for (msg_id,) in reversed(rows):
+                self._ids[msg_id] = True
+            self._db.execute(
+                'DELETE FROM ids WHERE id NOT IN (SELECT id FROM ids ORDER BY ts DESC, rowid DESC LIMIT ?)',
+                (self.maxsize,)
+            )
+            self._db.commit()
+        return len(rows)
+
+    def __contains__(self, msg_id: str) -> bool:
+        if self._redis is not None:
+            try:
+                return bool(self._redis.exists(f"seen:{msg_id}"))
+            except Exception as e:
+                logger.warning(f"Redis seen-ID lookup failed: {e}")
+        with self._lock:
+            return msg_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, msg_id: str) -> bool:
+        """
+        Claim a message for processing, evicting the oldest ID when full.
+        The claim only survives a restart once persist() is called.
+
+        Returns:
+            True if the ID was new, False if it had already been seen
+        """
+        if self._redis is not None:
+            try:
+                return bool(self._redis.set(f"seen:{msg_id}", 1, nx=True, ex=Config.PROCESSED_ID_TTL))
+            except Exception as e:
+                logger.warning(f"Redis seen-ID update failed, using local set: {e}")
+
+        with self._lock:
+            if msg_id in self._ids:
+                self._ids.move_to_end(msg_id)
+                return False
+            self._ids[msg_id] = True
+            if len(self._ids) > self.maxsize:
+                self._ids.popitem(last=False)
+            return True
+
+    def persist(self, msg_id: str):
+        """Record a message as handled on disk so the unread-inbox scan skips it after a restart"""
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO ids (id, ts) VALUES (?, ?)', (msg_id, int(time.time())))
+            self._db.commit()
+
+    def discard(self, msg_id: str):
+        """Release a claim so the message is picked up again, e.g. after a failed fetch"""
+        if self._redis is not None:
+            try:
+                self._redis.delete(f"seen:{msg_id}")
+            except Exception as e:
+                logger.warning(f"Redis seen-ID removal failed: {e}")
+        with self._lock:
+            self._ids.pop(msg_id, None)
@@ -12,6 +12,30 @@ from dotenv import load_dotenv
 env_path = Path(__file__).parent.parent / 'config' / '.env'
 load_dotenv(dotenv_path=env_path)
 
+# AI prompt instructions, keyed by SUMMARY_LENGTH. The header and footer wrap the email fields
+# in single-email prompts and are reused as-is for batch prompts.
+_SUMMARY_PROMPTS = {
+    'brief': {
+        'header': "Summarize this email in ONE concise sentence.\n"
+                  "Include only the most critical information.",
+        'footer': "Provide only the summary, no additional text.",
+    },
+    
+    'standard': {
+        'header': "Summarize this email in 2-3 clear sentences.\n"
+                  "Include: who sent it, what it's about, and any action needed.",
+        'footer': "Format for WhatsApp messaging. Be concise and actionable.",
+    },
+    
+    'detailed': {
+        'header': "Provide a comprehensive summary of this email.\n"
+                  "Include: sender, main topic, key points, and any action items or deadlines.",
+        'footer': "Format the summary for WhatsApp with clear structure. Use bullet points if needed.",
+    },
+}
+
+_EMAIL_FIELDS = "From: {sender}\nSubject: {subject}\nBody: {body}"
+
 
 class Config:
     """Central configuration class"""
@@ -20,10 +44,11 @@ class Config:
     BASE_DIR = Path(__file__).parent.parent
     CONFIG_DIR = BASE_DIR / 'config'
     LOGS_DIR = BASE_DIR / 'logs'
+    DATA_DIR = BASE_DIR / 'data'
     
     # Gmail Configuration
     GMAIL_CREDENTIALS_PATH = os.getenv('GMAIL_CREDENTIALS_PATH', 'config/credentials.json')
-    GMAIL_TOKEN_PATH = os.getenv('GMAIL_TOKEN_PATH', 'config/token.pickle')
+    GMAIL_TOKEN_PATH = os.getenv('GMAIL_TOKEN_PATH', 'config/token.json')
     GMAIL_SCOPES = ['https://www.googleapis.com/auth/gmail.readonly',
                     'https://www.googleapis.com/auth/pubsub']
     
@@ -31,10 +56,19 @@ class Config:
     PUBSUB_PROJECT_ID = os.getenv('PUBSUB_PROJECT_ID', '')
     PUBSUB_TOPIC_NAME = os.getenv('PUBSUB_TOPIC_NAME', 'gmail-notifications')
     PUBSUB_SUBSCRIPTION_NAME = os.getenv('PUBSUB_SUBSCRIPTION_NAME', 'gmail-sub')
+    PUBSUB_MAX_MESSAGES = int(os.getenv('PUBSUB_MAX_MESSAGES', '100'))
+    PUBSUB_MAX_BYTES = int(os.getenv('PUBSUB_MAX_BYTES', str(10 * 1024 * 1024)))  # 10MB
     
     # Google Gemini AI Configuration
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
     GEMINI_MODEL = "gemini-pro-latest"
+    GEMINI_REQUESTS_PER_MINUTE = int(os.getenv('GEMINI_REQUESTS_PER_MINUTE', '55'))  # Buffer under the 60 rpm quota
+    AI_SKIP_THRESHOLD = int(os.getenv('AI_SKIP_THRESHOLD', '200'))  # Bodies shorter than this are sent as-is
+    
+    # Summary Cache Settings
+    SUMMARY_CACHE_TTL = int(os.getenv('SUMMARY_CACHE_TTL', str(30 * 24 * 3600)))  # 30 days
+    SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95'))
     
     # WhatsApp Configuration
     YOUR_WHATSAPP_NUMBER = os.getenv('YOUR_WHATSAPP_NUMBER', '')
@@ -44,16 +78,27 @@ class Config:
     # Monitoring Settings
     PROCESS_EXISTING = os.getenv('PROCESS_EXISTING', 'false').lower() == 'true'
     SUMMARY_LENGTH = os.getenv('SUMMARY_LENGTH', 'standard')
+    SUMMARY_STYLE = _SUMMARY_PROMPTS.get(SUMMARY_LENGTH, _SUMMARY_PROMPTS['standard'])
+    SUMMARY_PROMPT = f"{SUMMARY_STYLE['header']}\n\n{_EMAIL_FIELDS}\n\n{SUMMARY_STYLE['footer']}"
     EMAIL_CHECK_INTERVAL = int(os.getenv('EMAIL_CHECK_INTERVAL', '300'))
+    SUMMARY_BATCH_SIZE = int(os.getenv('SUMMARY_BATCH_SIZE', '5'))
+    PROCESSED_CACHE_SIZE = int(os.getenv('PROCESSED_CACHE_SIZE', '10000'))
+    
+    # Shared cache for multi-worker deployments (optional)
+    REDIS_URL = os.getenv('REDIS_URL', '')
+    PROCESSED_ID_TTL = int(os.getenv('PROCESSED_ID_TTL', '86400'))  # 1 day
     
     # Logging Configuration
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     LOG_FILE = os.getenv('LOG_FILE', 'logs/app.log')
     LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', '10485760'))  # 10MB
     LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+    LOG_BUFFER_SIZE = int(os.getenv('LOG_BUFFER_SIZE', '50'))  # records buffered before a file write
+    STATS_LOG_INTERVAL = int(os.getenv('STATS_LOG_INTERVAL', '30'))  # seconds
     
     # Application Settings
     TIMEZONE = os.getenv('TIMEZONE', 'UTC')
+    WORKER_THREADS = int(os.getenv('WORKER_THREADS', '8'))
     MAX_RETRIES = int(os.getenv('MAX_RETRIES', '3'))
     RETRY_DELAY = int(os.getenv('RETRY_DELAY', '5'))
     
@@ -84,36 +129,12 @@ class Config:
     @classmethod
     def get_summary_prompt(cls):
         """Get the AI prompt template based on summary length"""
-        prompts = {
-            'brief': """Summarize this email in ONE concise sentence.
-Include only the most critical information.
-
-From: {sender}
-Subject: {subject}
-Body: {body}
-
-Provide only the summary, no additional text.""",
-            
-            'standard': """Summarize this email in 2-3 clear sentences.
-Include: who sent it, what it's about, and any action needed.
-
-From: {sender}
-Subject: {subject}
-Body: {body}
-
-Format for WhatsApp messaging. Be concise and actionable.""",
-            
-            'detailed': """Provide a comprehensive summary of this email.
-Include: sender, main topic, key points, and any action items or deadlines.
-
-From: {sender}
-Subject: {subject}
-Body: {body}
-
-Format the summary for WhatsApp with clear structure. Use bullet points if needed."""
-        }
-        
-        return prompts.get(cls.SUMMARY_LENGTH, prompts['standard'])
+        return cls.SUMMARY_PROMPT
+    
+    @classmethod
+    def get_summary_instructions(cls):
+        """Get the summary instructions without the per-email fields (used for batch prompts)"""
+        return f"{cls.SUMMARY_STYLE['header']}\n{cls.SUMMARY_STYLE['footer']}"
     
     @classmethod
     def setup_logging(cls):
@@ -133,7 +154,7 @@ Format the summary for WhatsApp with clear structure. Use bullet points if neede
         )
         
         # Setup file handler with rotation
-        from logging.handlers import RotatingFileHandler
+        from logging.handlers import MemoryHandler, RotatingFileHandler
         log_path = cls.BASE_DIR / cls.LOG_FILE
         file_handler = RotatingFileHandler(
             log_path,
@@ -143,6 +164,14 @@ Format the summary for WhatsApp with clear structure. Use bullet points if neede
         file_handler.setFormatter(file_formatter)
         file_handler.setLevel(getattr(logging, cls.LOG_LEVEL))
         
+        # Buffer file writes; errors (and a full buffer) flush immediately
+        buffered_handler = MemoryHandler(
+            capacity=cls.LOG_BUFFER_SIZE,
+            flushLevel=logging.ERROR,
+            target=file_handler
+        )
+        buffered_handler.setLevel(getattr(logging, cls.LOG_LEVEL))
+        
         # Setup console handler
         console_handler = logging.StreamHandler()
         console_handler.setFormatter(console_formatter)
@@ -151,7 +180,7 @@ Format the summary for WhatsApp with clear structure. Use bullet points if neede
         # Configure root logger
         root_logger = logging.getLogger()
         root_logger.setLevel(getattr(logging, cls.LOG_LEVEL))
-        root_logger.addHandler(file_handler)
+        root_logger.addHandler(buffered_handler)
         root_logger.addHandler(console_handler)
         
         return root_logger
@@ -2,72 +2,153 @@
 Email monitoring service using Gmail API with push notifications.
 Monitors inbox for new emails and triggers processing.
 """
+import os
 import logging
 import base64
-import time
+import orjson
 import re
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from google.cloud import pubsub_v1
 from googleapiclient.errors import HttpError
+from html.parser import HTMLParser as StdlibHTMLParser
 from config import Config
 from gmail_auth import GmailAuthenticator
+from cache import ProcessedIds
+
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:  # Fall back to the stdlib parser below
+    HTMLParser = None
 
 logger = logging.getLogger(__name__)
 
+# Gmail accepts up to 100 calls per batch but throttles individual calls above ~50
+GMAIL_BATCH_LIMIT = 50
+
+# Accept either bare IDs or full resource paths for the Pub/Sub settings
+_PROJECT_RE = re.compile(r'projects/([^/]+)')
+_TOPIC_RE = re.compile(r'topics/([^/]+)')
+
+# Unread inbox messages fetched to cover the gap when the history cursor has aged out
+STALE_CURSOR_CATCHUP_LIMIT = 100
+
+# Renew the Gmail watch this long before it expires, and retry failed renewals after this delay
+WATCH_RENEW_MARGIN = timedelta(hours=1)
+WATCH_RENEW_RETRY_SECONDS = 300
+
+# Longest body passed on to the summarizer
+MAX_BODY_CHARS = 5000
+# Base64 characters decoded per part (multiples of 4). Plain text is sized for MAX_BODY_CHARS
+# characters of up to 4 UTF-8 bytes each; HTML gets more room because markup is stripped afterwards.
+PLAIN_B64_CAP = -(-MAX_BODY_CHARS * 4 // 3) * 4
+HTML_B64_CAP = 200000
+_WS_RE = re.compile(r'\s+')
+
+
+class _TextExtractor(StdlibHTMLParser):
+    """Fallback HTML-to-text converter used when selectolax is not installed"""
+    SKIP_TAGS = {'script', 'style', 'head'}
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.chunks.append(data)
+
+
+def html_to_text(markup):
+    """Strip markup, scripts and styles from an HTML body"""
+    if HTMLParser is None:
+        extractor = _TextExtractor()
+        extractor.feed(markup)
+        extractor.close()
+        return ' '.join(extractor.chunks)
+    tree = HTMLParser(markup)
+    tree.strip_tags(['script', 'style', 'head'])
+    root = tree.body or tree.root
+    return root.text(separator=' ', strip=True) if root else ''
+
+
 class EmailMonitor:
     """Monitors Gmail inbox using push notifications"""
-    def __init__(self, on_new_email_callback):
+    def __init__(self, on_new_email_callback, on_new_emails_callback=None):
         self.auth = GmailAuthenticator()
         self.service = None
         self.callback = on_new_email_callback
-        self.processed_emails = set()
+        self.batch_callback = on_new_emails_callback
+        self.processed_emails = ProcessedIds(path=Config.DATA_DIR / 'processed_ids.db')
         self.watch_expiration = None
+        self._renew_timer = None
+        self._streaming_pull_future = None
+        self._stop = threading.Event()
+        
+        # Last history ID fetched, persisted so restarts resume where they left off
+        self.history_path = Config.DATA_DIR / 'last_history.txt'
+        self.last_history_id = self.history_path.read_text().strip() if self.history_path.exists() else None
+        self._history_lock = threading.Lock()
+        # Failed fetch attempts per message while the cursor is held for a retry
+        self._fetch_failures = {}
         
         # Pub/Sub setup from Config
         self.project_id = Config.PUBSUB_PROJECT_ID
         self.topic_name = Config.PUBSUB_TOPIC_NAME
         self.subscription_name = Config.PUBSUB_SUBSCRIPTION_NAME
         self.subscriber = None
+        
+        # Resolve the canonical IDs once; they are reused on every watch renewal
+        self._project_id = self._resolve_id(self.project_id, _PROJECT_RE)
+        self._topic_path = f"projects/{self._project_id}/topics/{self._resolve_id(self.topic_name, _TOPIC_RE)}"
     
     def initialize(self):
         logger.info("Initializing email monitor...")
+        loaded = self.processed_emails.load()
+        if loaded:
+            logger.info(f"Loaded {loaded} previously processed email IDs")
         self.service = self.auth.authenticate()
+        resume_from = self.last_history_id
         self.setup_push_notifications()
+        if resume_from:
+            logger.info(f"Catching up from history ID: {resume_from}")
+            self.fetch_new_messages()
         if Config.PROCESS_EXISTING:
             logger.info("Processing existing unread emails...")
             self.process_existing_emails()
         logger.info("Email monitor initialized successfully!")
     
+    @staticmethod
+    def _resolve_id(value, pattern):
+        """Extract the bare ID from a value that may be a full resource path"""
+        if '/' in value:
+            match = pattern.search(value)
+            if match:
+                return match.group(1)
+        return value.strip()
+    
     def setup_push_notifications(self):
         """Setup Gmail push notifications via Pub/Sub"""
         try:
             logger.info("Setting up Gmail push notifications...")
-            
-            # Safely extract Project ID and Topic ID regardless of .env format
-
-            # Extract just the project ID from the variable
-            project_id_match = re.search(r'projects/([^/]+)', self.project_id)
-            if project_id_match:
-                project_id = project_id_match.group(1)
-            else:
-                project_id = self.project_id.strip()
-
-            # Extract just the topic ID from the variable
-            topic_id_match = re.search(r'topics/([^/]+)', self.topic_name)
-            if topic_id_match:
-                topic_id = topic_id_match.group(1)
-            else:
-                topic_id = self.topic_name.strip()
-
-            # Build the canonical path
-            topic_path = f"projects/{project_id}/topics/{topic_id}"
-
-            logger.info(f"Using Pub/Sub project ID: {project_id}")
-            logger.info(f"Using Pub/Sub topic path: {topic_path}")
+            logger.info(f"Using Pub/Sub project ID: {self._project_id}")
+            logger.info(f"Using Pub/Sub topic path: {self._topic_path}")
             
             request = {
                 'labelIds': ['INBOX'],
-                'topicName': topic_path
+                'topicName': self._topic_path
             }
             
             response = self.service.users().watch(userId='me', body=request).execute()
@@ -76,43 +157,99 @@ class EmailMonitor:
             logger.info(f"Push notifications active until: {self.watch_expiration}")
             logger.info(f"History ID: {response['historyId']}")
             
+            # First run: start the history cursor at the mailbox's current position
+            if not self.last_history_id:
+                self.save_history_id(response['historyId'])
+            
             return response
             
         except HttpError as error:
             logger.error(f"Failed to setup push notifications: {error}")
             raise
 
-    def renew_watch(self):
-        if self.watch_expiration and datetime.now() >= self.watch_expiration - timedelta(hours=1):
+    def schedule_renewal(self, delay=None):
+        """Schedule a single wake-up to renew the watch shortly before it expires"""
+        if self._stop.is_set():
+            return
+        if delay is None:
+            if not self.watch_expiration:
+                return
+            delay = max(0, (self.watch_expiration - WATCH_RENEW_MARGIN - datetime.now()).total_seconds())
+        self._renew_timer = threading.Timer(delay, self._renew_and_reschedule)
+        self._renew_timer.daemon = True
+        self._renew_timer.start()
+        logger.info(f"Next watch renewal in {timedelta(seconds=int(delay))}")
+
+    def _renew_and_reschedule(self):
+        try:
             logger.info("Renewing push notification watch...")
             self.setup_push_notifications()
+            self.schedule_renewal()
+        except Exception as e:
+            logger.error(f"Watch renewal failed, retrying in {WATCH_RENEW_RETRY_SECONDS}s: {e}")
+            self.schedule_renewal(WATCH_RENEW_RETRY_SECONDS)
     
     def start_listening(self):
+        # Imported here so modules that only need parsing skip loading gRPC
+        from google.cloud import pubsub_v1
+        from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
+
         logger.info("Starting Pub/Sub listener...")
         self.subscriber = pubsub_v1.SubscriberClient()
-        subscription_path = self.subscriber.subscription_path(self.project_id, self.subscription_name)
+        subscription_path = self.subscriber.subscription_path(self._project_id, self.subscription_name)
         
         def pubsub_callback(message):
-            logger.info(f"Received push notification: {message.data}")
             message.ack()
-            self.handle_push_notification(message)
+            try:
+                data = orjson.loads(message.data)
+            except orjson.JSONDecodeError as e:
+                logger.error(f"Ignoring malformed push notification: {e}")
+                return
+            logger.debug(f"Received push notification: {data}")
+            self.handle_push_notification_data(data)
+        
+        # Allow more in-flight notifications and callback threads than the library defaults
+        flow_control = pubsub_v1.types.FlowControl(
+            max_messages=Config.PUBSUB_MAX_MESSAGES,
+            max_bytes=Config.PUBSUB_MAX_BYTES
+        )
+        scheduler = ThreadScheduler(
+            executor=ThreadPoolExecutor(max_workers=Config.WORKER_THREADS, thread_name_prefix='pubsub-callback')
+        )
         
-        streaming_pull_future = self.subscriber.subscribe(subscription_path, callback=pubsub_callback)
+        self._stop.clear()
+        self._streaming_pull_future = self.subscriber.subscribe(
+            subscription_path,
+            callback=pubsub_callback,
+            flow_control=flow_control,
+            scheduler=scheduler
+        )
         logger.info(f"Listening for messages on {subscription_path}...")
         
+        # Block on the subscriber itself; it returns once stop_listening() cancels it
+        self.schedule_renewal()
         try:
-            while True:
-                time.sleep(60)
-                self.renew_watch()
+            self._streaming_pull_future.result()
         except KeyboardInterrupt:
-            logger.info("Stopping listener...")
-            streaming_pull_future.cancel()
-            streaming_pull_future.result()
+            self.stop_listening()
+            self._streaming_pull_future.result()
+        finally:
+            self.stop_listening()
 
-    def handle_push_notification(self, message):
+    def stop_listening(self):
+        """Stop the Pub/Sub listener and cancel the pending watch renewal"""
+        if self._stop.is_set():
+            return
+        logger.info("Stopping listener...")
+        self._stop.set()
+        if self._renew_timer:
+            self._renew_timer.cancel()
+        if self._streaming_pull_future:
+            self._streaming_pull_future.cancel()
+
+    def handle_push_notification_data(self, data: dict):
+        """Handle an already-decoded Gmail push notification"""
         try:
-            import json
-            data = json.loads(message.data.decode('utf-8'))
             email_address = data.get('emailAddress')
             history_id = data.get('historyId')
             logger.info(f"Push notification for {email_address}, history ID: {history_id}")
@@ -120,70 +257,260 @@ class EmailMonitor:
         except Exception as e:
             logger.error(f"Error handling push notification: {e}", exc_info=True)
     
-    def fetch_new_messages(self, history_id):
-        try:
-            history = self.service.users().history().list(userId='me', startHistoryId=history_id, historyTypes=['messageAdded']).execute()
-            if 'history' not in history:
+    def fetch_new_messages(self, notified_id=None):
+        """
+        List and dispatch messages added since the stored history cursor.
+        
+        Args:
+            notified_id: History ID from a push notification, or None to catch up from the cursor
+        """
+        with self._history_lock:
+            # Read the cursor under the lock so a caller that waited lists from where the previous one stopped;
+            # redelivered or out-of-order pushes carry IDs the cursor has already covered
+            cursor = self.last_history_id
+            if cursor and notified_id and int(notified_id) <= int(cursor):
+                logger.debug(f"History ID {notified_id} already processed (cursor {cursor})")
                 return
-            for record in history['history']:
-                if 'messagesAdded' in record:
-                    for msg_added in record['messagesAdded']:
-                        msg_id = msg_added['message']['id']
-                        if msg_id in self.processed_emails:
-                            continue
-                        if 'INBOX' in msg_added['message'].get('labelIds', []):
-                            self.process_email(msg_id)
-        except HttpError as error:
-            logger.error(f"Error fetching history: {error}")
+            history_id = cursor or notified_id
+            try:
+                candidate_ids, latest_history_id = self._list_history(history_id)
+            except HttpError as error:
+                if error.resp.status == 404 and cursor:
+                    logger.warning(f"History ID {history_id} is no longer available, catching up from the inbox")
+                    self._recover_stale_cursor()
+                else:
+                    logger.error(f"Error fetching history: {error}")
+                return
+            # Claim only once every page is listed, so a failed page leaves nothing claimed but unfetched
+            new_ids = [msg_id for msg_id in candidate_ids if self.processed_emails.add(msg_id)]
+            failed = self._count_fetch_failures(self._fetch_and_dispatch(new_ids))
+            if failed:
+                # Keep the cursor so the next notification lists (and retries) these messages again
+                logger.warning(f"{len(failed)} emails could not be fetched, keeping history cursor at {history_id}")
+            elif latest_history_id:
+                self._fetch_failures.clear()
+                self.save_history_id(latest_history_id)
 
-    def process_email(self, email_id):
+    def _count_fetch_failures(self, failed):
+        """
+        Track repeated fetch failures so one bad message cannot pin the history cursor.
+        
+        Returns:
+            IDs still worth holding the cursor for; IDs that failed MAX_RETRIES times are dropped
+        """
+        retry = []
+        for email_id in failed:
+            attempts = self._fetch_failures.get(email_id, 0) + 1
+            self._fetch_failures[email_id] = attempts
+            if attempts < Config.MAX_RETRIES:
+                retry.append(email_id)
+            elif attempts == Config.MAX_RETRIES:
+                logger.error(f"Giving up on email {email_id} after {attempts} failed fetches")
+        return retry
+
+    def _fetch_and_dispatch(self, email_ids):
+        """
+        Fetch and dispatch claimed emails, releasing every claim if the fetch itself blows up.
+        
+        Returns:
+            IDs that could not be fetched and were released for a retry
+        """
+        if not email_ids:
+            return []
         try:
-            self.processed_emails.add(email_id)
-            email_data = self.get_email_data(email_id)
-            if email_data:
-                self.callback(email_id, email_data)
+            emails, failed = self.get_emails_data(email_ids)
         except Exception as e:
-            logger.error(f"Error processing email {email_id}: {e}", exc_info=True)
+            logger.error(f"Error fetching emails: {e}", exc_info=True)
+            for email_id in email_ids:
+                self.processed_emails.discard(email_id)
+            return list(email_ids)
+        self.dispatch_emails(emails)
+        return failed
+
+    def _list_history(self, history_id):
+        """
+        Page through history since history_id.
+        
+        Returns:
+            IDs of messages added to the inbox, and the mailbox's latest history ID
+        """
+        msg_ids = []
+        latest_history_id = None
+        page_token = None
+        while True:
+            history = self.service.users().history().list(
+                userId='me', startHistoryId=history_id, historyTypes=['messageAdded'], pageToken=page_token
+            ).execute()
+            for record in history.get('history', []):
+                for msg_added in record.get('messagesAdded', []):
+                    if 'INBOX' in msg_added['message'].get('labelIds', []):
+                        msg_ids.append(msg_added['message']['id'])
+            latest_history_id = history.get('historyId', latest_history_id)
+            page_token = history.get('nextPageToken')
+            if not page_token:
+                return msg_ids, latest_history_id
 
-    def get_email_data(self, email_id):
+    def _recover_stale_cursor(self):
+        """
+        Gmail only keeps about a week of history. Restart the cursor at the mailbox's current
+        position, then pick up the gap from the unread inbox instead of skipping it.
+        """
         try:
-            message = self.service.users().messages().get(userId='me', id=email_id, format='full').execute()
-            headers = message['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-            sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown')
-            date = next((h['value'] for h in headers if h['name'].lower() == 'date'), '')
-            body = self.extract_body(message['payload'])
-            return {'id': email_id, 'subject': subject, 'sender': sender, 'date': date, 'body': body, 'snippet': message.get('snippet', '')}
+            head = self.service.users().getProfile(userId='me').execute()['historyId']
         except HttpError as error:
-            logger.error(f"Error fetching email {email_id}: {error}")
-            return None
+            logger.error(f"Failed to reset history cursor: {error}")
+            return
+        self.save_history_id(head)
+        self.process_existing_emails(max_results=STALE_CURSOR_CATCHUP_LIMIT)
+
+    def save_history_id(self, history_id):
+        """Atomically persist the history cursor; it only ever moves forward"""
+        if self.last_history_id and int(history_id) <= int(self.last_history_id):
+            return
+        self.last_history_id = str(history_id)
+        try:
+            self.history_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.history_path.parent, prefix='.last_history')
+            with os.fdopen(fd, 'w') as tmp:
+                tmp.write(self.last_history_id)
+            os.replace(tmp_path, self.history_path)
+        except OSError as e:
+            logger.error(f"Failed to save history ID: {e}")
+
+    def mark_processed(self, email_id):
+        """
+        Persist an email as handled once it has been delivered.
+        The history cursor advances when emails are dispatched, not delivered, so an email whose delivery
+        failed is only picked up again by the unread-inbox scans (PROCESS_EXISTING or stale-cursor recovery).
+        """
+        self.processed_emails.persist(email_id)
+
+    def dispatch_emails(self, emails):
+        """Forward fetched (email_id, email_data) pairs to the batch or per-email callback"""
+        if self.batch_callback:
+            batch_size = max(1, Config.SUMMARY_BATCH_SIZE)
+            for start in range(0, len(emails), batch_size):
+                try:
+                    self.batch_callback(emails[start:start + batch_size])
+                except Exception as e:
+                    logger.error(f"Error processing email batch: {e}", exc_info=True)
+            return
+        for email_id, email_data in emails:
+            try:
+                self.callback(email_id, email_data)
+            except Exception as e:
+                logger.error(f"Error processing email {email_id}: {e}", exc_info=True)
+
+    def get_emails_data(self, email_ids):
+        """
+        Fetch several emails using Gmail batch requests.
+        
+        Returns:
+            (email_id, email_data) pairs in order, and the IDs whose fetch failed and were released for a retry
+        """
+        fetched = {}
+        throttled = []
+        failed = []
+
+        def on_fetched(request_id, response, exception):
+            if exception is not None:
+                if isinstance(exception, HttpError) and exception.resp.status == 429:
+                    throttled.append(request_id)
+                    return
+                logger.error(f"Error fetching email {request_id}: {exception}")
+                # A deleted message will never be fetchable; anything else is worth another try
+                if not (isinstance(exception, HttpError) and exception.resp.status == 404):
+                    failed.append(request_id)
+                return
+            try:
+                fetched[request_id] = self.parse_message(response)
+            except Exception as e:
+                logger.error(f"Error parsing email {request_id}: {e}", exc_info=True)
+
+        pending = list(email_ids)
+        for attempt in range(Config.MAX_RETRIES):
+            for start in range(0, len(pending), GMAIL_BATCH_LIMIT):
+                batch = self.service.new_batch_http_request(callback=on_fetched)
+                chunk = pending[start:start + GMAIL_BATCH_LIMIT]
+                for email_id in chunk:
+                    batch.add(self.service.users().messages().get(userId='me', id=email_id, format='full'), request_id=email_id)
+                try:
+                    batch.execute()
+                except Exception as e:
+                    # The batch response itself failed (e.g. 503 or a transport error): fail the whole chunk
+                    logger.error(f"Error fetching batch of {len(chunk)} emails: {e}")
+                    failed.extend(
+                        email_id for email_id in chunk
+                        if email_id not in fetched and email_id not in failed and email_id not in throttled
+                    )
+            if not throttled:
+                break
+            if attempt == Config.MAX_RETRIES - 1:
+                for email_id in throttled:
+                    logger.error(f"Error fetching email {email_id}: rate limit exceeded")
+                failed.extend(throttled)
+                break
+            # Calls rejected for rate limiting are retried in a smaller follow-up batch
+            pending, throttled = throttled, []
+            logger.warning(f"{len(pending)} email fetches rate limited, retrying in {Config.RETRY_DELAY}s")
+            time.sleep(Config.RETRY_DELAY)
+
+        for email_id in failed:
+            self.processed_emails.discard(email_id)
+        return [(email_id, fetched[email_id]) for email_id in email_ids if email_id in fetched], failed
+
+    def parse_message(self, message):
+        # Reversed so the first occurrence of a repeated header wins
+        headers = {h['name'].lower(): h['value'] for h in reversed(message['payload']['headers'])}
+        subject = headers.get('subject', 'No Subject')
+        sender = headers.get('from', 'Unknown')
+        date = headers.get('date', '')
+        body = self.extract_body(message['payload'])
+        return {'id': message['id'], 'subject': subject, 'sender': sender, 'date': date, 'body': body, 'snippet': message.get('snippet', '')}
 
     def extract_body(self, payload):
-        body = ""
-        if 'parts' in payload:
-            for part in payload['parts']:
-                if part['mimeType'] == 'text/plain' and 'data' in part['body']:
-                    body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                    break
-                elif part['mimeType'] == 'text/html' and not body and 'data' in part['body']:
-                    body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-        elif 'data' in payload['body']:
-            body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
-        return ' '.join(body.split())[:5000]
-
-    def process_existing_emails(self):
+        # Walk nested multipart trees breadth-first, picking the part before decoding anything
+        part = None
+        queue = deque([payload])
+        while queue:
+            candidate = queue.popleft()
+            if 'parts' in candidate:
+                queue.extend(candidate['parts'])
+                continue
+            mime_type = candidate.get('mimeType', '')
+            # Skip attachments, including text files sent as attachments
+            if candidate.get('filename') or 'data' not in candidate.get('body', {}):
+                continue
+            if mime_type == 'text/plain':
+                part = candidate
+                break
+            elif mime_type == 'text/html' and part is None:
+                part = candidate
+        if part is None:
+            return ""
+        is_html = part['mimeType'] == 'text/html'
+        # Decode only the prefix we can use instead of the whole part
+        data = part['body']['data'][:HTML_B64_CAP if is_html else PLAIN_B64_CAP]
+        data += '=' * (-len(data) % 4)
+        body = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
+        if is_html:
+            body = html_to_text(body)
+        return _WS_RE.sub(' ', body).strip()[:MAX_BODY_CHARS]
+
+    def process_existing_emails(self, max_results=10):
         try:
-            results = self.service.users().messages().list(userId='me', labelIds=['INBOX', 'UNREAD'], maxResults=10).execute()
+            results = self.service.users().messages().list(userId='me', labelIds=['INBOX', 'UNREAD'], maxResults=max_results).execute()
             messages = results.get('messages', [])
             if messages:
                 logger.info(f"Found {len(messages)} unread emails")
-                for message in messages:
-                    self.process_email(message['id'])
+                email_ids = [message['id'] for message in messages if self.processed_emails.add(message['id'])]
+                self._fetch_and_dispatch(email_ids)
         except HttpError as error:
             logger.error(f"Error fetching existing emails: {error}")
 
 if __name__ == '__main__':
     def test_callback(email_id, email_data):
+        monitor.mark_processed(email_id)
         print(f"\n{'='*60}\nNew Email: {email_id}\nFrom: {email_data['sender']}\nSubject: {email_data['subject']}\nBody: {email_data['body'][:200]}...\n{'='*60}\n")
     
     monitor = EmailMonitor(on_new_email_callback=test_callback)
@@ -4,18 +4,19 @@ Handles OAuth2 flow and token persistence.
 """
 
 import os
-import pickle
 import logging
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+# Refresh tokens that expire within this window instead of reusing them
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
 
 class GmailAuthenticator:
     """Handles Gmail API authentication"""
@@ -33,15 +34,28 @@ class GmailAuthenticator:
         """
         logger.info("Starting Gmail authentication...")
         
+        # Tokens are stored as JSON now; an old pickle cannot be read, and the OAuth flow
+        # that would replace it needs a browser, so stop instead of hanging in a container
+        legacy_path = self.token_path.with_suffix('.pickle')
+        if self.token_path.suffix == '.pickle' or (legacy_path.exists() and not self.token_path.exists()):
+            raise RuntimeError(
+                f"Found a legacy pickle token ({legacy_path}); tokens are now stored as JSON at "
+                f"{self.token_path.with_suffix('.json')}.\n"
+                "Re-run 'python src/gmail_auth.py' on a machine with a browser and deploy the new token.json."
+            )
+        
         # Load existing token if available
         if self.token_path.exists():
             logger.info("Loading existing token...")
-            with open(self.token_path, 'rb') as token:
-                self.creds = pickle.load(token)
+            try:
+                self.creds = Credentials.from_authorized_user_file(str(self.token_path), Config.GMAIL_SCOPES)
+            except (ValueError, UnicodeDecodeError) as e:
+                # Also covers tokens left over from the old pickle format
+                logger.warning(f"Could not read token file, re-authenticating: {e}")
         
         # If no valid credentials, authenticate
-        if not self.creds or not self.creds.valid:
-            if self.creds and self.creds.expired and self.creds.refresh_token:
+        if self._needs_refresh():
+            if self.creds and self.creds.refresh_token:
                 logger.info("Refreshing expired token...")
                 self.creds.refresh(Request())
             else:
@@ -52,6 +66,7 @@ class GmailAuthenticator:
                         "Please download OAuth2 credentials from Google Cloud Console."
                     )
                 
+                from google_auth_oauthlib.flow import InstalledAppFlow
                 flow = InstalledAppFlow.from_client_secrets_file(
                     str(self.credentials_path),
                     Config.GMAIL_SCOPES
@@ -61,15 +76,27 @@ class GmailAuthenticator:
             # Save the credentials for next run
             logger.info("Saving credentials...")
             self.token_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(self.token_path, 'wb') as token:
-                pickle.dump(self.creds, token)
+            tmp_path = self.token_path.with_suffix('.tmp')
+            tmp_path.write_text(self.creds.to_json())
+            os.replace(tmp_path, self.token_path)
         
-        # Build Gmail service
+        # Build Gmail service (discovery client is only loaded once it is needed)
+        from googleapiclient.discovery import build
         self.service = build('gmail', 'v1', credentials=self.creds)
         logger.info("Gmail authentication successful!")
         
         return self.service
     
+    def _needs_refresh(self):
+        """True when there is no usable token or it expires within TOKEN_REFRESH_MARGIN"""
+        if not self.creds or not self.creds.valid:
+            return True
+        if not self.creds.expiry:
+            return False
+        # google-auth stores expiry as a naive UTC datetime
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return self.creds.expiry - now < TOKEN_REFRESH_MARGIN
+    
     def get_service(self):
         """Get authenticated Gmail service"""
         if not self.service:
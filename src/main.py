@@ -3,17 +3,19 @@ Main orchestration script for Email-to-WhatsApp automation.
 Coordinates email monitoring, AI summarization, and WhatsApp notifications.
 """
 
+import asyncio
 import logging
 import sys
 import signal
 import time
+import threading
+from concurrent.futures import wait
 from pathlib import Path
 
 # Add src directory to path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from config import Config
-from email_monitor import EmailMonitor
 from ai_summarizer import EmailSummarizer
 from whatsapp_sender import WhatsAppSender
 
@@ -35,6 +37,21 @@ class EmailWhatsAppBot:
             'messages_sent': 0,
             'errors': 0
         }
+        self._stats_lock = threading.Lock()
+        self._last_stats_log = time.monotonic()
+        
+        # Emails are summarized and sent as coroutines on a dedicated event loop,
+        # so the Pub/Sub callback returns immediately and I/O overlaps on one thread
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name='email-loop', daemon=True)
+        self._loop_thread.start()
+        self._slots = asyncio.Semaphore(Config.WORKER_THREADS)
+        self._pending = set()
+    
+    def _count(self, stat: str, amount: int = 1):
+        """Thread-safe stats increment (emails may be handled concurrently)"""
+        with self._stats_lock:
+            self.stats[stat] += amount
     
     def initialize(self):
         """Initialize all services"""
@@ -72,8 +89,11 @@ class EmailWhatsAppBot:
             
             # Initialize email monitor (with callback)
             logger.info("\n[Email] Initializing email monitor...")
+            # Imported here so --test does not load the Gmail API client stack
+            from email_monitor import EmailMonitor
             self.email_monitor = EmailMonitor(
-                on_new_email_callback=self.handle_new_email
+                on_new_email_callback=self.handle_new_email,
+                on_new_emails_callback=self.handle_new_emails
             )
             self.email_monitor.initialize()
             logger.info("OK: Email monitor ready")
@@ -94,59 +114,132 @@ class EmailWhatsAppBot:
     
     def handle_new_email(self, email_id: str, email_data: dict):
         """
-        Callback function for new emails.
+        Callback function for new emails. Queues the email and returns immediately.
         
         Args:
             email_id: Gmail message ID
             email_data: Email data dictionary
         """
-        try:
-            logger.info("\n" + "="*60)
-            logger.info(f"[Email] Processing new email: {email_id}")
-            logger.info("="*60)
-            
-            sender = email_data.get('sender', 'Unknown')
-            subject = email_data.get('subject', 'No Subject')
-            
-            logger.info(f"From: {sender}")
-            logger.info(f"Subject: {subject}")
-            
-            self.stats['emails_processed'] += 1
+        self._schedule(self._handle_new_email_async(email_id, email_data))
+    
+    def handle_new_emails(self, emails: list):
+        """
+        Callback function for a batch of emails. Queues the batch and returns immediately.
+        
+        Args:
+            emails: List of (email_id, email_data) tuples
+        """
+        # A lone email goes through the fully async path instead of the threaded batch request
+        if len(emails) == 1:
+            self.handle_new_email(*emails[0])
+            return
+        self._schedule(self._handle_new_emails_async(emails))
+    
+    def _schedule(self, coro):
+        """Run a coroutine on the email loop from any thread, tracking it until it finishes"""
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        with self._stats_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._forget)
+    
+    def _forget(self, future):
+        with self._stats_lock:
+            self._pending.discard(future)
+    
+    async def _handle_new_email_async(self, email_id: str, email_data: dict):
+        """Summarize a single email and send it to WhatsApp"""
+        async with self._slots:
+            try:
+                logger.info(f"[Email] Processing new email: {email_id}")
+                logger.debug(f"From: {email_data.get('sender', 'Unknown')}")
+                logger.debug(f"Subject: {email_data.get('subject', 'No Subject')}")
+                
+                self._count('emails_processed')
+                
+                # Generate AI summary
+                logger.debug("[AI] Generating AI summary...")
+                summary = await self.summarizer.summarize_email_async(email_data)
+                
+                if not summary:
+                    logger.error("Failed to generate summary")
+                    self._count('errors')
+                    return
+                
+                await self._deliver(email_id, email_data, summary)
+                
+            except Exception as e:
+                logger.error(f"Error handling email {email_id}: {e}", exc_info=True)
+                self._count('errors')
+    
+    async def _handle_new_emails_async(self, emails: list):
+        """Summarize a batch of emails with one AI request and send each to WhatsApp"""
+        async with self._slots:
+            logger.info(f"\n[Email] Processing batch of {len(emails)} emails")
+            self._count('emails_processed', len(emails))
             
-            # Generate AI summary
-            logger.info("\n[AI] Generating AI summary...")
-            summary = self.summarizer.summarize_email(email_data)
+            try:
+                logger.debug("[AI] Generating AI summaries...")
+                # The batch request is synchronous (JSON mode with per-email fallback), so keep it off the loop
+                summaries = await asyncio.to_thread(
+                    self.summarizer.summarize_batch, [email_data for _, email_data in emails]
+                )
+            except Exception as e:
+                logger.error(f"Error summarizing email batch: {e}", exc_info=True)
+                self._count('errors', len(emails))
+                return
             
+            await asyncio.gather(*(
+                self._deliver_one(email_id, email_data, summary)
+                for (email_id, email_data), summary in zip(emails, summaries)
+            ))
+    
+    async def _deliver_one(self, email_id: str, email_data: dict, summary: str):
+        """Deliver one email of a batch, counting failures instead of raising"""
+        try:
+            logger.debug(f"[Email] {email_id} - Subject: {email_data.get('subject', 'No Subject')}")
             if not summary:
                 logger.error("Failed to generate summary")
-                self.stats['errors'] += 1
+                self._count('errors')
                 return
-            
-            self.stats['summaries_generated'] += 1
-            logger.info(f"Summary: {summary[:100]}...")
-            
-            # Send to WhatsApp
-            logger.info("\n[WhatsApp] Sending WhatsApp notification...")
-            success = self.whatsapp.send_email_notification(email_data, summary)
-            
-            if success:
-                self.stats['messages_sent'] += 1
-                logger.info("OK: Email notification sent successfully!")
-            else:
-                logger.error("ERROR: Failed to send WhatsApp notification")
-                self.stats['errors'] += 1
-            
-            # Log stats
-            logger.info("\n[Stats] Statistics:")
-            logger.info(f"  Emails processed: {self.stats['emails_processed']}")
-            logger.info(f"  Summaries generated: {self.stats['summaries_generated']}")
-            logger.info(f"  Messages sent: {self.stats['messages_sent']}")
-            logger.info(f"  Errors: {self.stats['errors']}")
-            logger.info("="*60 + "\n")
-            
+            await self._deliver(email_id, email_data, summary)
         except Exception as e:
             logger.error(f"Error handling email {email_id}: {e}", exc_info=True)
-            self.stats['errors'] += 1
+            self._count('errors')
+    
+    async def _deliver(self, email_id: str, email_data: dict, summary: str):
+        """Send a generated summary to WhatsApp and log statistics"""
+        self._count('summaries_generated')
+        logger.debug(f"Summary: {summary[:100]}...")
+        
+        # Send to WhatsApp
+        logger.debug("[WhatsApp] Sending WhatsApp notification...")
+        success = await self.whatsapp.send_email_notification_async(email_data, summary)
+        
+        if success:
+            self._count('messages_sent')
+            logger.info(f"OK: Notification sent for {email_id}")
+            await asyncio.to_thread(self.email_monitor.mark_processed, email_id)
+        else:
+            logger.error("ERROR: Failed to send WhatsApp notification")
+            self._count('errors')
+        
+        self._log_stats()
+    
+    def _log_stats(self):
+        """Log running statistics, at most once every STATS_LOG_INTERVAL seconds"""
+        with self._stats_lock:
+            now = time.monotonic()
+            if now - self._last_stats_log < Config.STATS_LOG_INTERVAL:
+                return
+            self._last_stats_log = now
+            stats = dict(self.stats)
+        
+        logger.info(
+            f"[Stats] Emails processed: {stats['emails_processed']}, "
+            f"summaries generated: {stats['summaries_generated']}, "
+            f"messages sent: {stats['messages_sent']}, "
+            f"errors: {stats['errors']}"
+        )
     
     def run(self):
         """Start the bot"""
@@ -156,12 +249,17 @@ class EmailWhatsAppBot:
         
         self.running = True
         
+        # Stop cleanly on SIGTERM (docker stop) as well as Ctrl+C
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        
         try:
             logger.info("Bot is now running and monitoring your inbox...")
             logger.info("Press Ctrl+C to stop.\n")
             
-            # Start email monitoring (blocks until interrupted)
+            # Start email monitoring (blocks until stopped)
             self.email_monitor.start_listening()
+            logger.info("\n\n[System] Received shutdown signal...")
+            self.shutdown()
             
         except KeyboardInterrupt:
             logger.info("\n\n[System] Received shutdown signal...")
@@ -173,11 +271,26 @@ class EmailWhatsAppBot:
         
         return True
     
+    def _handle_signal(self, signum, frame):
+        """Signal handler: unblock the listener so run() can shut down"""
+        # Cancelling the subscriber joins its threads, so do it off the signal handler
+        threading.Thread(target=self.email_monitor.stop_listening, daemon=True).start()
+    
     def shutdown(self):
         """Graceful shutdown"""
         logger.info("Shutting down bot...")
         self.running = False
         
+        # Let queued emails finish before reporting final stats
+        with self._stats_lock:
+            pending = list(self._pending)
+        wait(pending)
+        if self.whatsapp:
+            asyncio.run_coroutine_threadsafe(self.whatsapp.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop.close()
+        
         # Log final stats
         logger.info("\n" + "="*60)
         logger.info("[Stats] Final Statistics")
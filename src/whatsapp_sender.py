@@ -3,16 +3,45 @@ WhatsApp sender - Python client for WhatsApp Web.js service.
 Communicates with the Node.js WhatsApp service via HTTP.
 """
 
+import asyncio
+import functools
 import logging
+import re
+import httpx
 import requests
 import time
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from typing import Optional
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+_WA_TEMPLATE = (
+    "📧 *New Email*\n\n"
+    "👤 *From:* {sender}\n\n"
+    "📌 *Subject:* {subject}\n\n"
+    "📝 *Summary:*\n{summary}\n\n"
+    "🕐 *Received:* {timestamp}"
+)
+
+_TIMESTAMP_FORMAT = '%I:%M %p, %b %d'
+
+# How long a successful send or health check counts as proof the service is ready
+READY_TTL_SECONDS = 300
+
+# Cheap shape check for RFC 2822 dates ("Mon, 1 Jan 2024 ..."; the day name is optional)
+_RFC2822_RE = re.compile(r'^(?:[A-Z][a-z]{2}, )?\d{1,2} [A-Z][a-z]{2} \d{4}')
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_email_date(date_str: str) -> datetime:
+    """Parse an email Date header, memoized since the same header is often formatted repeatedly"""
+    return parsedate_to_datetime(date_str)
+
 
 class WhatsAppSender:
     """Sends messages to WhatsApp via the Node.js service"""
@@ -22,7 +51,26 @@ class WhatsAppSender:
         self.service_url = Config.WHATSAPP_SERVICE_URL
         self.target_number = Config.YOUR_WHATSAPP_NUMBER
         self.max_retries = Config.MAX_RETRIES
-        self.retry_delay = Config.RETRY_DELAY
+        
+        # One keep-alive session for all calls; urllib3 retries connection errors and gateway failures.
+        # 503 is left to send_message, which waits for the service to become ready.
+        retry = Retry(
+            total=self.max_retries,
+            backoff_factor=0.5,
+            status_forcelist=(502, 504),
+            allowed_methods=frozenset(['GET', 'POST']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=Config.WORKER_THREADS, max_retries=retry)
+        self._session = requests.Session()
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        
+        # monotonic() deadline until which the service is known to be ready
+        self._ready_until = 0.0
+        
+        # Async client for the worker event loop, created on first use inside that loop
+        self._async_client = None
         
         logger.info(f"WhatsApp sender initialized (service: {self.service_url})")
     
@@ -36,16 +84,20 @@ class WhatsAppSender:
         Returns:
             True if ready, False if timeout
         """
+        if time.monotonic() < self._ready_until:
+            return True
+        
         logger.info("Waiting for WhatsApp service to be ready...")
         start_time = time.time()
         
         while time.time() - start_time < timeout:
             try:
-                response = requests.get(f"{self.service_url}/health", timeout=5)
+                response = self._session.get(f"{self.service_url}/health", timeout=5)
                 data = response.json()
                 
                 if data.get('status') == 'ready':
                     logger.info("WhatsApp service is ready!")
+                    self._ready_until = time.monotonic() + READY_TTL_SECONDS
                     return True
                 
                 status = data.get('status', 'unknown')
@@ -81,7 +133,7 @@ class WhatsAppSender:
         
         for attempt in range(self.max_retries):
             try:
-                response = requests.post(
+                response = self._session.post(
                     f"{self.service_url}/send",
                     json={
                         'number': target,
@@ -89,37 +141,107 @@ class WhatsAppSender:
                     },
                     timeout=30
                 )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get('success'):
-                        logger.info("✅ WhatsApp message sent successfully!")
-                        return True
-                    else:
-                        error = data.get('error', 'Unknown error')
-                        logger.error(f"WhatsApp service error: {error}")
-                
-                elif response.status_code == 503:
-                    logger.warning("WhatsApp service not ready, waiting...")
-                    if not self.wait_for_ready(timeout=30):
-                        logger.error("WhatsApp service did not become ready")
-                        return False
-                    continue
-                
-                else:
-                    logger.error(f"HTTP error {response.status_code}: {response.text}")
-                
             except requests.exceptions.RequestException as e:
-                logger.error(f"Request failed (attempt {attempt + 1}/{self.max_retries}): {e}")
+                logger.error(f"Request failed after {self.max_retries} retries: {e}")
+                return False
+            
+            result = self._check_send_response(response)
+            if result is not None:
+                return result
+            
+            logger.warning(f"WhatsApp service not ready, waiting (attempt {attempt + 1}/{self.max_retries})...")
+            if not self.wait_for_ready(timeout=30):
+                logger.error("WhatsApp service did not become ready")
+                return False
+        
+        logger.error("Failed to send WhatsApp message after all retries")
+        return False
+    
+    async def send_message_async(self, message: str, number: Optional[str] = None) -> bool:
+        """
+        Send a message to WhatsApp without blocking the event loop.
+        
+        Args:
+            message: Message text to send
+            number: Optional phone number (uses configured number if not provided)
+        
+        Returns:
+            True if sent successfully, False otherwise
+        """
+        target = number or self.target_number
+        
+        logger.info(f"Sending WhatsApp message to {target}")
+        logger.debug(f"Message: {message[:100]}...")
+        
+        client = self._get_async_client()
+        for attempt in range(self.max_retries):
+            try:
+                response = await client.post(
+                    f"{self.service_url}/send",
+                    json={
+                        'number': target,
+                        'message': message
+                    }
+                )
+            except httpx.HTTPError as e:
+                logger.error(f"Request failed after {self.max_retries} retries: {e}")
+                return False
+            
+            result = self._check_send_response(response)
+            if result is not None:
+                return result
             
-            # Retry with delay
-            if attempt < self.max_retries - 1:
-                logger.info(f"Retrying in {self.retry_delay} seconds...")
-                time.sleep(self.retry_delay)
+            logger.warning(f"WhatsApp service not ready, waiting (attempt {attempt + 1}/{self.max_retries})...")
+            if not await asyncio.to_thread(self.wait_for_ready, 30):
+                logger.error("WhatsApp service did not become ready")
+                return False
         
         logger.error("Failed to send WhatsApp message after all retries")
         return False
     
+    def _check_send_response(self, response) -> Optional[bool]:
+        """Interpret a /send response; None means the service is not ready (503) and the send should be retried"""
+        if response.status_code == 200:
+            self._ready_until = time.monotonic() + READY_TTL_SECONDS
+            try:
+                data = response.json()
+            except ValueError as e:
+                # requests and httpx both raise ValueError subclasses for non-JSON bodies
+                logger.error(f"Invalid response from WhatsApp service: {e}")
+                return False
+            if data.get('success'):
+                logger.info("✅ WhatsApp message sent successfully!")
+                return True
+            error = data.get('error', 'Unknown error')
+            logger.error(f"WhatsApp service error: {error}")
+            return False
+        
+        if response.status_code == 503:
+            self._ready_until = 0.0
+            return None
+        
+        logger.error(f"HTTP error {response.status_code}: {response.text}")
+        return False
+    
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Keep-alive async client; the transport retries failed connections"""
+        if self._async_client is None:
+            # Limits go on the transport: AsyncClient ignores its own limits when given a transport
+            self._async_client = httpx.AsyncClient(
+                timeout=30.0,
+                transport=httpx.AsyncHTTPTransport(
+                    retries=self.max_retries,
+                    limits=httpx.Limits(max_connections=16, max_keepalive_connections=8)
+                )
+            )
+        return self._async_client
+    
+    async def aclose(self):
+        """Close the async client's connections"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+    
     def send_email_notification(self, email_data: dict, summary: str) -> bool:
         """
         Send a formatted email notification to WhatsApp.
@@ -131,36 +253,32 @@ class WhatsAppSender:
         Returns:
             True if sent successfully
         """
-        # Format the message
-        sender = email_data.get('sender', 'Unknown')
-        subject = email_data.get('subject', 'No Subject')
-        date = email_data.get('date', '')
-        
-        # Parse and format date
-        timestamp = self._format_timestamp(date)
-        
-        # Build message
-        message = f"📧 *New Email*\n\n"
-        message += f"👤 *From:* {sender}\n\n"
-        message += f"📌 *Subject:* {subject}\n\n"
-        message += f"📝 *Summary:*\n{summary}\n\n"
-        message += f"🕐 *Received:* {timestamp}"
-        
-        return self.send_message(message)
+        return self.send_message(self._format_notification(email_data, summary))
+    
+    async def send_email_notification_async(self, email_data: dict, summary: str) -> bool:
+        """Async variant of send_email_notification"""
+        return await self.send_message_async(self._format_notification(email_data, summary))
+    
+    def _format_notification(self, email_data: dict, summary: str) -> str:
+        """Build the WhatsApp message text for an email"""
+        return _WA_TEMPLATE.format(
+            sender=email_data.get('sender', 'Unknown'),
+            subject=email_data.get('subject', 'No Subject'),
+            summary=summary,
+            timestamp=self._format_timestamp(email_data.get('date', ''))
+        )
     
     def _format_timestamp(self, date_str: str) -> str:
         """Format email date string to readable timestamp"""
-        if not date_str:
-            return datetime.now().strftime('%I:%M %p, %b %d')
+        # Only hand RFC 2822-shaped strings to the parser; anything else falls back without raising
+        if date_str and _RFC2822_RE.match(date_str):
+            try:
+                return _parse_email_date(date_str).strftime(_TIMESTAMP_FORMAT)
+            except (TypeError, ValueError):
+                pass
         
-        try:
-            # Try to parse common email date formats
-            from email.utils import parsedate_to_datetime
-            dt = parsedate_to_datetime(date_str)
-            return dt.strftime('%I:%M %p, %b %d')
-        except:
-            # Fallback to current time
-            return datetime.now().strftime('%I:%M %p, %b %d')
+        # Fallback to current time
+        return datetime.now().strftime(_TIMESTAMP_FORMAT)
     
     def test_connection(self) -> bool:
         """
@@ -172,7 +290,7 @@ class WhatsAppSender:
         try:
             logger.info("Testing WhatsApp service connection...")
             
-            response = requests.post(
+            response = self._session.post(
                 f"{self.service_url}/test",
                 timeout=30
             )